@@ -1,13 +1,361 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import base64
 import json
+import re
+import orjson
 import numpy as np
 import cv2
 from PIL import Image
 import io
 import os
+import gzip
+import time
+import hashlib
+import threading
+import queue
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
 
+try:
+    # Optional: libjpeg-turbo bindings (SIMD colour conversion + entropy coding)
+    from turbojpeg import TurboJPEG
+except ImportError:
+    TurboJPEG = None
+
+try:
+    # Optional: JIT-compiled pre-processing kernel for local face embedding
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Approximate prompt tokens charged per image, for rate limiting
+IMAGE_TOKEN_ESTIMATE = 800
+
+# Face crops are resized to this before being sent to OpenRouter for feature extraction
+FACE_CROP_SIZE = (224, 224)
+
+# ArcFace input size and normalization ((pixel - mean) / std, RGB order). The defaults (0, 1) feed
+# raw 0-255 pixels, as arcfaceresnet100-8.onnx normalizes inside its graph; see FACE_EMBEDDING_MEAN
+EMBEDDING_INPUT_SIZE = (112, 112)
+EMBEDDING_MEAN = np.full(3, Config.FACE_EMBEDDING_MEAN, dtype=np.float32)
+EMBEDDING_STD = np.full(3, Config.FACE_EMBEDDING_STD, dtype=np.float32)
+
+# Where ArcFace expects the eyes, nose tip and mouth corners in its 112x112 input (image left to right,
+# the same order as YuNet's landmarks); faces are warped onto these before embedding
+ARCFACE_LANDMARKS = np.array([
+    [38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366], [41.5493, 92.3655], [70.7299, 92.2041]
+], dtype=np.float32)
+
+# Outermost JSON object/array in a model reply (replies often wrap JSON in prose or code fences)
+_JSON_OBJECT_RE = re.compile(rb"\{.*\}", re.S)
+_JSON_ARRAY_RE = re.compile(rb"\[.*\]", re.S)
+
+# Prompts are built once at import; per request only the image parts change
+_DETECT_PROMPT = """Analyze this image and detect all human faces. For each face detected, provide:
+1. Bounding box coordinates (x, y, width, height) as percentages of image dimensions
+2. Confidence score (0.0 to 1.0)
+3. Basic facial features description for comparison
+
+Format your response as JSON:
+{
+  "faces": [
+    {
+      "bbox": {"x": 0.1, "y": 0.2, "width": 0.3, "height": 0.4},
+      "confidence": 0.95,
+      "features": "description of key facial features"
+    }
+  ],
+  "total_faces": 1
+}
+
+If no faces are detected, return: {"faces": [], "total_faces": 0}"""
+
+_FEATURE_PROMPT = """Analyze this face image and extract detailed facial features for identification purposes. Provide:
+
+1. Facial structure: face shape, jawline, cheekbones
+2. Eyes: shape, size, color, eyebrow shape
+3. Nose: shape, size, bridge characteristics
+4. Mouth: lip shape, size, smile characteristics
+5. Distinctive features: any unique marks, facial hair, etc.
+6. Overall facial proportions and key measurements
+
+Create a detailed feature descriptor that could be used to match this face against others. Format as JSON:
+
+{
+  "feature_vector": "detailed textual description of all facial features",
+  "key_features": ["feature1", "feature2", "feature3"],
+  "face_hash": "unique identifier based on features"
+}"""
+
+# str.format templates (literal braces are doubled)
+_FEATURE_BATCH_PROMPT_TMPL = """Analyze each of the {count} face images below and extract detailed facial features for identification purposes. For each face provide:
+
+1. Facial structure: face shape, jawline, cheekbones
+2. Eyes: shape, size, color, eyebrow shape
+3. Nose: shape, size, bridge characteristics
+4. Mouth: lip shape, size, smile characteristics
+5. Distinctive features: any unique marks, facial hair, etc.
+6. Overall facial proportions and key measurements
+
+Return a JSON array with exactly one object per face, in the same order as the images:
+
+[
+  {{
+    "feature_vector": "detailed textual description of all facial features",
+    "key_features": ["feature1", "feature2", "feature3"],
+    "face_hash": "unique identifier based on features"
+  }}
+]"""
+
+_COMPARE_PROMPT_TMPL = """Compare these two facial feature descriptions and determine how similar they are:
+
+Face 1 Features: {face1}
+
+Face 2 Features: {face2}
+
+Analyze the similarity based on:
+1. Facial structure and proportions
+2. Eye characteristics
+3. Nose features
+4. Mouth and lip features
+5. Overall facial geometry
+6. Distinctive features
+
+Provide a similarity score from 0.0 (completely different) to 1.0 (identical match).
+Consider a score above 0.7 as a likely match for the same person.
+
+Return only a JSON response:
+{{
+  "similarity_score": 0.85,
+  "confidence": 0.9,
+  "reasoning": "brief explanation of the comparison"
+}}"""
+
+_DETECT_PROMPT_PART = {"type": "text", "text": _DETECT_PROMPT}
+_FEATURE_PROMPT_PART = {"type": "text", "text": _FEATURE_PROMPT}
+
+
+@lru_cache(maxsize=16)
+def _feature_batch_prompt(count):
+    """Batch feature prompt for count faces"""
+    return _FEATURE_BATCH_PROMPT_TMPL.format(count=count)
+
+
+
+if njit is not None:
+    # Serial on purpose: a 112x112 crop is too small to amortize starting a parallel region
+    @njit(fastmath=True, cache=True)
+    def _preprocess_bgr(bgr, mean, std, out):
+        """BGR uint8 HWC -> normalized RGB float32 CHW in one pass (out is written in place)"""
+        height, width, _ = bgr.shape
+        for y in range(height):
+            for x in range(width):
+                out[0, y, x] = (bgr[y, x, 2] - mean[0]) / std[0]
+                out[1, y, x] = (bgr[y, x, 1] - mean[1]) / std[1]
+                out[2, y, x] = (bgr[y, x, 0] - mean[2]) / std[2]
+else:
+    _preprocess_bgr = None
+
+
+class CacheMiss(Exception):
+    """Raised in replay cache mode when a request has no recorded response"""
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache with a TTL for OpenRouter responses
+    Keys are content hashes of the request, so identical frames/crops skip the API call
+    With a directory, responses are also kept on disk (gzip) so they survive restarts; the TTL
+    applies to those files too (by mtime) unless expire_files is False, as in replay mode
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600, directory=None, expire_files=True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.directory = directory
+        self.expire_files = expire_files
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._prune_files()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.gz")
+
+    def _remember(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _prune_files(self):
+        """Delete expired files from the disk tier (at most once per TTL)"""
+        if not self.expire_files or time.time() < self._next_prune:
+            return
+        self._next_prune = time.time() + self.ttl
+        cutoff = time.time() - self.ttl
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.name.endswith('.gz') and entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+        except OSError as e:
+            print(f"Error pruning AI response cache: {e}")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            ttl = None
+            if self.expire_files:
+                ttl = self.ttl - (time.time() - os.path.getmtime(path))
+                if ttl <= 0:
+                    os.remove(path)
+                    return None
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        self._remember(key, value, ttl)
+        return value
+
+    def set(self, key, value):
+        self._remember(key, value)
+        if self.directory:
+            # Write to a temp file and rename so readers never see a partial entry
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                f.write(value)
+            os.replace(tmp_path, self._path(key))
+            self._prune_files()
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter for requests/minute and tokens/minute
+    acquire() reserves capacity up front and sleeps off any deficit, so bursts are smoothed
+    to the provider's sustainable rate instead of hitting 429s and retry backoff
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.request_rate = requests_per_minute / 60.0
+        self.token_rate = tokens_per_minute / 60.0
+        self.request_capacity = float(requests_per_minute)
+        self.token_capacity = float(tokens_per_minute)
+        self.request_tokens = self.request_capacity
+        self.token_tokens = self.token_capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self.request_tokens = min(self.request_capacity, self.request_tokens + elapsed * self.request_rate)
+        self.token_tokens = min(self.token_capacity, self.token_tokens + elapsed * self.token_rate)
+
+    def acquire(self, estimated_tokens):
+        """Block until one request carrying estimated_tokens may be sent"""
+        with self._lock:
+            self._refill()
+            self.request_tokens -= 1
+            self.token_tokens -= estimated_tokens
+            wait = max(-self.request_tokens / self.request_rate,
+                       -self.token_tokens / self.token_rate,
+                       0.0)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class FaceIndex:
+    """
+    In-memory inner-product index over L2-normalized face embeddings
+    Rows are kept as one contiguous float32 matrix, so scoring a face against every
+    enrolled student is a single BLAS matrix-vector product
+    """
+
+    def __init__(self):
+        self._matrix = None
+        self._ids = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @staticmethod
+    def normalize(vectors):
+        """L2-normalize a vector, or each row of a matrix (zero rows are left as-is)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def add(self, vector, student_id):
+        """Enroll a single embedding"""
+        row = self.normalize(vector).reshape(1, -1)
+        with self._lock:
+            self._matrix = row if self._matrix is None else np.vstack([self._matrix, row])
+            self._ids.append(student_id)
+
+    def replace(self, vectors, student_ids):
+        """Swap in a freshly built set of embeddings"""
+        # Rows are normalized once here, so a search is a bare dot product per student
+        matrix = None
+        if student_ids:
+            matrix = np.ascontiguousarray(self.normalize(vectors).reshape(len(student_ids), -1))
+        with self._lock:
+            self._matrix = matrix
+            self._ids = list(student_ids)
+
+    def search(self, vector, k=1):
+        """Return the top-k (student_id, similarity) pairs, best first"""
+        with self._lock:
+            matrix, ids = self._matrix, self._ids
+        if matrix is None:
+            return []
+
+        scores = matrix @ self.normalize(vector)
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(ids[i], float(scores[i])) for i in top]
+
+    def search_many(self, vectors):
+        """
+        Best (student_id, similarity) match for each row of an (F, D) query matrix
+        All faces of a frame are scored in one (F, D) x (D, N) sgemm
+        """
+        with self._lock:
+            matrix, ids = self._matrix, self._ids
+        if matrix is None or len(vectors) == 0:
+            return [(None, 0.0)] * len(vectors)
+
+        scores = self.normalize(vectors) @ matrix.T
+        best = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(best)), best]
+        return [(ids[i], float(score)) for i, score in zip(best, best_scores)]
+
+
 class AIService:
     def __init__(self):
         self.api_key = Config.OPENROUTER_API_KEY
@@ -17,295 +365,890 @@ class AIService:
             "Content-Type": "application/json"
         }
         
+        # One pooled keep-alive session for all OpenRouter calls (avoids a TLS handshake per request)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=16,
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.3,
+                # No 429: a retry here would skip self._limiter and push further past the rate limit
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset(['POST']),
+                raise_on_status=False
+            )
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
         # Using free models from OpenRouter that are good for image analysis
         self.vision_model = "google/gemini-flash-1.5"  # Free and good for vision tasks
         self.backup_model = "meta-llama/llama-3.2-11b-vision-instruct:free"  # Free backup
 
+        # On-device face detector (YuNet) — OpenRouter is only used when it can't be loaded
+        self.face_detector = self._load_face_detector()
+        self._detector_lock = threading.Lock()  # setInputSize + detect must not interleave
+
+        # On-device face embedding (ArcFace) — replaces the LLM feature/compare round trips
+        self.face_embedder = self._load_face_embedder()
+        self._embedder_lock = threading.Lock()  # cv2.dnn.Net is not thread-safe
+
+        # Minimum similarity for a match — cosine scores run lower than the LLM's 0-1 rating
+        self.match_threshold = Config.EMBEDDING_MATCH_THRESHOLD if self.face_embedder is not None else 0.75
+
+        # JPEG encoder for images sent to OpenRouter
+        self._jpeg = self._load_jpeg_encoder()
+
+        # Shared worker pool so independent OpenRouter calls overlap instead of queuing
+        self._executor = ThreadPoolExecutor(max_workers=Config.AI_MAX_CONCURRENT_REQUESTS,
+                                            thread_name_prefix='ai-request')
+
+        # Content-hashed response cache — static scenes keep producing identical requests.
+        # 'enabled' caches in memory and on disk, 'replay' serves only recorded responses
+        # (a miss raises CacheMiss), 'disabled' always calls the API.
+        self.cache_mode = Config.AI_CACHE_MODE
+        if self.cache_mode not in ('enabled', 'replay', 'disabled'):
+            raise ValueError(f"Invalid AI_CACHE_MODE: {self.cache_mode}")
+        if self.cache_mode == 'replay' and not Config.AI_CACHE_DIR:
+            # Without recorded responses every replayed request would be a CacheMiss
+            raise ValueError("AI_CACHE_MODE=replay requires AI_CACHE_DIR")
+        # Recorded responses must not age out while replaying them
+        self._response_cache = ResponseCache(maxsize=Config.AI_CACHE_SIZE, ttl=Config.AI_CACHE_TTL,
+                                             directory=Config.AI_CACHE_DIR,
+                                             expire_files=self.cache_mode != 'replay')
+
+        # Enrolled student embeddings, searched in place of pairwise compare_faces calls
+        self.face_index = FaceIndex()
+
+        # Keep bursts of frames within the provider's request/token limits
+        self._limiter = RateLimiter(Config.AI_REQUESTS_PER_MINUTE, Config.AI_TOKENS_PER_MINUTE)
+
+        # Result of the last processed frame, reused for near-duplicate frames (OpenRouter detection only)
+        self._last_thumbnail = None
+        self._last_processed_at = 0.0
+        self._last_processed_faces = []
+        self._frame_cache_lock = threading.Lock()
+
+        # Faces tracked across frames by bbox overlap, so a person who stays in view is not
+        # re-extracted on every frame (features are still refreshed every TRACK_REEXTRACT_AFTER frames)
+        self._tracks = []
+        self._frame_count = 0
+        self._track_lock = threading.Lock()
+
+    def _load_face_detector(self):
+        """Load the YuNet ONNX face detector, or return None to fall back to OpenRouter"""
+        model_path = Config.FACE_DETECTION_MODEL
+        if not os.path.exists(model_path):
+            print(f"Face detection model not found at {model_path} — using OpenRouter for detection")
+            return None
+        try:
+            return cv2.FaceDetectorYN.create(
+                model_path, "", (320, 320),
+                score_threshold=Config.FACE_DETECTION_THRESHOLD
+            )
+        except Exception as e:
+            print(f"Error loading face detector: {e}")
+            return None
+
+    def _load_jpeg_encoder(self):
+        """Use TurboJPEG when it and libjpeg-turbo are installed, otherwise cv2.imencode"""
+        if TurboJPEG is None:
+            return None
+        try:
+            return TurboJPEG()
+        except Exception as e:
+            print(f"TurboJPEG unavailable ({e}) — using OpenCV JPEG encoding")
+            return None
+
+    def _load_face_embedder(self):
+        """Load the ArcFace ONNX embedding model, or return None to fall back to OpenRouter"""
+        model_path = Config.FACE_EMBEDDING_MODEL
+        if not os.path.exists(model_path):
+            print(f"Face embedding model not found at {model_path} — using OpenRouter for features")
+            return None
+        try:
+            return cv2.dnn.readNetFromONNX(model_path)
+        except Exception as e:
+            print(f"Error loading face embedding model: {e}")
+            return None
+
+    def _detect_faces_locally(self, frame):
+        """
+        Detect faces with YuNet on the CPU
+        Returns the same {bbox, confidence} schema as the OpenRouter path,
+        with bbox values as fractions of the image dimensions
+        """
+        height, width = frame.shape[:2]
+        with self._detector_lock:
+            self.face_detector.setInputSize((width, height))
+            _, detections = self.face_detector.detect(frame)
+
+        if detections is None:
+            return []
+
+        faces = []
+        # Each row is x, y, w, h, five landmark (x, y) pairs, score
+        for row in detections:
+            x, y, w, h = (float(v) for v in row[:4])
+            # Clip both edges to the frame, so a face partly out of view keeps only its visible part
+            x0, y0 = max(x, 0.0), max(y, 0.0)
+            x1, y1 = min(x + w, float(width)), min(y + h, float(height))
+            if x1 <= x0 or y1 <= y0:
+                continue
+            faces.append({
+                'bbox': {
+                    'x': x0 / width,
+                    'y': y0 / height,
+                    'width': (x1 - x0) / width,
+                    'height': (y1 - y0) / height
+                },
+                'landmarks': [[float(row[i]) / width, float(row[i + 1]) / height] for i in range(4, 14, 2)],
+                'confidence': float(row[-1])
+            })
+        return faces
+
+    def _embed_faces_locally(self, face_regions):
+        """
+        Run ArcFace on a batch of face crops in a single forward pass
+        Returns an (N, 512) float32 array of L2-normalized embeddings
+        """
+        if _preprocess_bgr is not None:
+            # Resize with OpenCV, then swap/normalize/transpose each crop straight into the blob.
+            # Bilinear, like blobFromImages, so embeddings don't depend on whether numba is installed.
+            width, height = EMBEDDING_INPUT_SIZE
+            blob = np.empty((len(face_regions), 3, height, width), dtype=np.float32)
+            for i, face_region in enumerate(face_regions):
+                resized = cv2.resize(face_region, EMBEDDING_INPUT_SIZE, interpolation=cv2.INTER_LINEAR)
+                _preprocess_bgr(resized, EMBEDDING_MEAN, EMBEDDING_STD, blob[i])
+        else:
+            blob = cv2.dnn.blobFromImages(
+                face_regions, scalefactor=1.0 / EMBEDDING_STD[0], size=EMBEDDING_INPUT_SIZE,
+                mean=tuple(EMBEDDING_MEAN.tolist()), swapRB=True
+            )
+        with self._embedder_lock:
+            self.face_embedder.setInput(blob)
+            embeddings = self.face_embedder.forward().reshape(len(face_regions), -1).astype(np.float32)
+
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embeddings / norms
+
+    def _embed_face_locally(self, face_region):
+        """
+        Run ArcFace on a face crop
+        Returns an L2-normalized float32 embedding (512-D)
+        """
+        return self._embed_faces_locally([face_region])[0]
+
+    def _crop_largest_face(self, image):
+        """Crop the largest detected face from a full photo (e.g. an enrollment picture)"""
+        if self.face_detector is None:
+            return image
+
+        faces = self._detect_faces_locally(image)
+        if not faces:
+            return image
+
+        face = max(faces, key=lambda f: f['bbox']['width'] * f['bbox']['height'])
+        face_region = self._face_crop(image, face)
+        return face_region if face_region is not None else image
+
+    @staticmethod
+    def _align_face(image, landmarks):
+        """
+        Warp a face onto ArcFace's canonical 112x112 layout using its five landmarks
+        (the same similarity transform as cv2.FaceRecognizerSF.alignCrop); None if it can't be estimated
+        """
+        height, width = image.shape[:2]
+        points = np.asarray(landmarks, dtype=np.float32) * np.array([width, height], dtype=np.float32)
+        matrix, _ = cv2.estimateAffinePartial2D(points, ARCFACE_LANDMARKS, method=cv2.LMEDS)
+        if matrix is None:
+            return None
+        return cv2.warpAffine(image, matrix, EMBEDDING_INPUT_SIZE)
+
+    def _face_crop(self, image, face):
+        """
+        The image region features are extracted from: a landmark-aligned crop for the local embedder
+        when the detector supplied landmarks, otherwise the bounding box
+        """
+        if self.face_embedder is not None and face.get('landmarks'):
+            aligned = self._align_face(image, face['landmarks'])
+            if aligned is not None:
+                return aligned
+        return self._crop(image, face.get('bbox', {}))
+
+    @staticmethod
+    def _crop(image, bbox):
+        """
+        Cut a normalized {x, y, width, height} box out of an image, clamped to its bounds
+        Returns a contiguous copy (so encoders and DNN calls don't re-pack strides), or None if the box is empty
+        """
+        height, width = image.shape[:2]
+        x0 = min(max(int(bbox.get('x', 0) * width), 0), width)
+        y0 = min(max(int(bbox.get('y', 0) * height), 0), height)
+        x1 = min(max(int((bbox.get('x', 0) + bbox.get('width', 0)) * width), x0), width)
+        y1 = min(max(int((bbox.get('y', 0) + bbox.get('height', 0)) * height), y0), height)
+        if x1 == x0 or y1 == y0:
+            return None
+        return np.ascontiguousarray(image[y0:y1, x0:x1])
+
+    @staticmethod
+    def _as_embedding(features):
+        """Return features as a float32 vector if they are a numeric embedding, else None"""
+        if isinstance(features, np.ndarray):
+            return features.astype(np.float32, copy=False)
+        if isinstance(features, (list, tuple)) and features and isinstance(features[0], (int, float)):
+            return np.asarray(features, dtype=np.float32)
+        return None
+
+    @staticmethod
+    def _cache_key(*parts):
+        """
+        BLAKE2b digest of a request's model, prompt and image data
+        Images are hashed as raw pixels/file bytes, so a cache hit skips JPEG and base64 encoding
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode()
+            elif isinstance(part, np.ndarray):
+                digest.update(str(part.shape).encode())
+                part = memoryview(np.ascontiguousarray(part)).cast('B')
+            digest.update(len(part).to_bytes(8, 'little'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _estimate_tokens(payload):
+        """Rough token cost of a request: ~4 characters per text token, a flat cost per image, plus the reply"""
+        tokens = payload.get("max_tokens", 0)
+        for message in payload["messages"]:
+            parts = message["content"]
+            if isinstance(parts, str):
+                tokens += len(parts) // 4
+                continue
+            for part in parts:
+                if part["type"] == "text":
+                    tokens += len(part["text"]) // 4
+                elif part["type"] == "image_url":
+                    tokens += IMAGE_TOKEN_ESTIMATE
+        return tokens
+
+    def _chat_completion(self, cache_key, build_payload):
+        """
+        Send a chat completion request to OpenRouter, serving repeats from the response cache
+        build_payload is only called on a cache miss
+        Returns the message content, or None on an API error
+        """
+        if self.cache_mode != 'disabled':
+            content = self._response_cache.get(cache_key)
+            if content is not None:
+                return content
+            if self.cache_mode == 'replay':
+                raise CacheMiss(cache_key)
+
+        payload = build_payload()
+        if payload is None:
+            return None
+
+        self._limiter.acquire(self._estimate_tokens(payload))
+        response = self.session.post(
+            f"{self.base_url}/chat/completions",
+            data=orjson.dumps(payload),
+            timeout=30
+        )
+
+        if response.status_code != 200:
+            print(f"AI API Error: {response.status_code} - {response.text}")
+            return None
+
+        content = response.json()['choices'][0]['message']['content']
+        if self.cache_mode != 'disabled':
+            self._response_cache.set(cache_key, content)
+        return content
+
+    @staticmethod
+    def _parse_json(content, pattern=_JSON_OBJECT_RE):
+        """Parse the JSON embedded in a model reply, or return None if there is none"""
+        match = pattern.search(content.encode())
+        if match is None:
+            return None
+        try:
+            return orjson.loads(match.group())
+        except orjson.JSONDecodeError:
+            return None
+
+    def _encode_jpeg(self, image):
+        """JPEG-encode a BGR image at AI_JPEG_QUALITY"""
+        if self._jpeg is not None:
+            return self._jpeg.encode(image, quality=Config.AI_JPEG_QUALITY)
+        _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, Config.AI_JPEG_QUALITY])
+        return buffer
+
+    @staticmethod
+    def _image_source(image_path_or_array):
+        """Read an image file's bytes, or pass a numpy array through; None if unreadable"""
+        try:
+            if isinstance(image_path_or_array, str):
+                with open(image_path_or_array, "rb") as image_file:
+                    return image_file.read()
+            if isinstance(image_path_or_array, np.ndarray):
+                return image_path_or_array
+            raise ValueError("Invalid image input type")
+        except Exception as e:
+            print(f"Error reading image: {e}")
+            return None
+
     def encode_image_to_base64(self, image_path_or_array):
-        """Convert image file or numpy array to base64 string"""
+        """Convert image file, encoded image bytes or numpy array to base64 string"""
         try:
             if isinstance(image_path_or_array, str):
                 # It's a file path
                 with open(image_path_or_array, "rb") as image_file:
-                    return base64.b64encode(image_file.read()).decode('utf-8')
+                    return base64.b64encode(image_file.read()).decode('ascii')
+            elif isinstance(image_path_or_array, bytes):
+                # Already-encoded image file contents
+                return base64.b64encode(image_path_or_array).decode('ascii')
             elif isinstance(image_path_or_array, np.ndarray):
-                # It's a numpy array (from OpenCV)
-                _, buffer = cv2.imencode('.jpg', image_path_or_array)
-                return base64.b64encode(buffer).decode('utf-8')
+                # It's a numpy array (from OpenCV) — b64encode reads the JPEG buffer without copying it
+                return base64.b64encode(self._encode_jpeg(image_path_or_array)).decode('ascii')
             else:
                 raise ValueError("Invalid image input type")
         except Exception as e:
             print(f"Error encoding image: {e}")
             return None
 
+    @staticmethod
+    def _image_part(base64_image):
+        """Content part carrying one base64 JPEG"""
+        return {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + base64_image}}
+
+    def _detect_faces_payload(self, image):
+        """Build the OpenRouter face detection request"""
+        base64_image = self.encode_image_to_base64(image)
+        if not base64_image:
+            return None
+
+        return {
+            "model": self.vision_model,
+            "messages": [{"role": "user", "content": [_DETECT_PROMPT_PART, self._image_part(base64_image)]}],
+            "max_tokens": 1000,
+            "temperature": 0.1
+        }
+
+    def _face_features_payload(self, image):
+        """Build the OpenRouter feature extraction request for one face"""
+        base64_image = self.encode_image_to_base64(image)
+        if not base64_image:
+            return None
+
+        return {
+            "model": self.vision_model,
+            "messages": [{"role": "user", "content": [_FEATURE_PROMPT_PART, self._image_part(base64_image)]}],
+            "max_tokens": 1500,
+            "temperature": 0.1
+        }
+
+    def _face_features_batch_payload(self, face_regions):
+        """Build one OpenRouter feature extraction request covering several faces"""
+        content = [{"type": "text", "text": _feature_batch_prompt(len(face_regions))}]
+        for i, face_region in enumerate(face_regions):
+            base64_image = self.encode_image_to_base64(face_region)
+            if not base64_image:
+                return None
+            content.append({"type": "text", "text": f"Face {i}:"})
+            content.append(self._image_part(base64_image))
+
+        return {
+            "model": self.vision_model,
+            "messages": [{"role": "user", "content": content}],
+            "max_tokens": 1500 * len(face_regions),
+            "temperature": 0.1
+        }
+
+    def _compare_faces_payload(self, face1_features, face2_features):
+        """Build the OpenRouter request comparing two feature descriptions"""
+        return {
+            "model": self.vision_model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": _COMPARE_PROMPT_TMPL.format(
+                        face1=json.dumps(face1_features, indent=2),
+                        face2=json.dumps(face2_features, indent=2)
+                    )
+                }
+            ],
+            "max_tokens": 500,
+            "temperature": 0.1
+        }
+
     def detect_faces_in_image(self, image_data):
         """
-        Detect faces in an image using OpenRouter AI
+        Detect faces in an image — locally with YuNet when available, otherwise via OpenRouter AI
         Returns list of face bounding boxes and confidence scores
         """
         try:
-            base64_image = self.encode_image_to_base64(image_data)
-            if not base64_image:
-                return []
+            if self.face_detector is not None:
+                frame = cv2.imread(image_data) if isinstance(image_data, str) else image_data
+                if isinstance(frame, np.ndarray) and frame.size > 0:
+                    return self._detect_faces_locally(frame)
 
-            payload = {
-                "model": self.vision_model,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": """Analyze this image and detect all human faces. For each face detected, provide:
-1. Bounding box coordinates (x, y, width, height) as percentages of image dimensions
-2. Confidence score (0.0 to 1.0)
-3. Basic facial features description for comparison
-
-Format your response as JSON:
-{
-  "faces": [
-    {
-      "bbox": {"x": 0.1, "y": 0.2, "width": 0.3, "height": 0.4},
-      "confidence": 0.95,
-      "features": "description of key facial features"
-    }
-  ],
-  "total_faces": 1
-}
+            image = self._image_source(image_data)
+            if image is None:
+                return []
 
-If no faces are detected, return: {"faces": [], "total_faces": 0}"""
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                "max_tokens": 1000,
-                "temperature": 0.1
-            }
-
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=30
+            content = self._chat_completion(
+                self._cache_key(self.vision_model, _DETECT_PROMPT, image),
+                lambda: self._detect_faces_payload(image)
             )
 
-            if response.status_code == 200:
-                result = response.json()
-                content = result['choices'][0]['message']['content']
-                
-                # Extract JSON from the response
-                try:
-                    # Find JSON in the response
-                    start_idx = content.find('{')
-                    end_idx = content.rfind('}') + 1
-                    if start_idx >= 0 and end_idx > start_idx:
-                        json_str = content[start_idx:end_idx]
-                        face_data = json.loads(json_str)
-                        return face_data.get('faces', [])
-                except json.JSONDecodeError:
+            if content is not None:
+                face_data = self._parse_json(content)
+                if not isinstance(face_data, dict):
                     print("Error parsing AI response JSON")
                     return []
+                return face_data.get('faces', [])
             else:
-                print(f"AI API Error: {response.status_code} - {response.text}")
                 return []
 
+        except CacheMiss:
+            raise
         except Exception as e:
             print(f"Error detecting faces: {e}")
             return []
 
     def extract_face_features(self, image_data):
         """
-        Extract facial features for comparison using AI
-        Returns a feature vector/description for face matching
+        Extract facial features for comparison
+        Returns a normalized ArcFace embedding (np.ndarray) when the local model is loaded,
+        otherwise an OpenRouter feature description (dict)
         """
         try:
-            base64_image = self.encode_image_to_base64(image_data)
-            if not base64_image:
-                return None
+            if self.face_embedder is not None:
+                if isinstance(image_data, str):
+                    image = cv2.imread(image_data)
+                    if image is None:
+                        return None
+                    image = self._crop_largest_face(image)
+                else:
+                    image = image_data
+                return self._embed_face_locally(image)
 
-            payload = {
-                "model": self.vision_model,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": """Analyze this face image and extract detailed facial features for identification purposes. Provide:
-
-1. Facial structure: face shape, jawline, cheekbones
-2. Eyes: shape, size, color, eyebrow shape
-3. Nose: shape, size, bridge characteristics
-4. Mouth: lip shape, size, smile characteristics
-5. Distinctive features: any unique marks, facial hair, etc.
-6. Overall facial proportions and key measurements
-
-Create a detailed feature descriptor that could be used to match this face against others. Format as JSON:
+            image = self._image_source(image_data)
+            if image is None:
+                return None
 
-{
-  "feature_vector": "detailed textual description of all facial features",
-  "key_features": ["feature1", "feature2", "feature3"],
-  "face_hash": "unique identifier based on features"
-}"""
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                "max_tokens": 1500,
-                "temperature": 0.1
-            }
-
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=30
+            content = self._chat_completion(
+                self._cache_key(self.vision_model, _FEATURE_PROMPT, image),
+                lambda: self._face_features_payload(image)
             )
 
-            if response.status_code == 200:
-                result = response.json()
-                content = result['choices'][0]['message']['content']
-                
-                try:
-                    start_idx = content.find('{')
-                    end_idx = content.rfind('}') + 1
-                    if start_idx >= 0 and end_idx > start_idx:
-                        json_str = content[start_idx:end_idx]
-                        feature_data = json.loads(json_str)
-                        return feature_data
-                except json.JSONDecodeError:
+            if content is not None:
+                feature_data = self._parse_json(content)
+                if feature_data is None:
                     # If JSON parsing fails, return the raw content as feature vector
                     return {
                         "feature_vector": content,
                         "key_features": [],
                         "face_hash": str(hash(content))
                     }
+                return feature_data
             else:
-                print(f"AI API Error: {response.status_code} - {response.text}")
                 return None
 
+        except CacheMiss:
+            raise
         except Exception as e:
             print(f"Error extracting face features: {e}")
             return None
 
-    def compare_faces(self, face1_features, face2_features):
+    def extract_face_features_batch(self, face_regions):
         """
-        Compare two face feature sets using AI
-        Returns similarity score between 0.0 and 1.0
+        Extract features for every face crop of a frame at once — one ArcFace forward pass,
+        or one multi-image OpenRouter request instead of one request per face
+        Returns a list aligned with face_regions (None where extraction failed)
         """
+        if not face_regions:
+            return []
+
         try:
-            if not face1_features or not face2_features:
-                return 0.0
+            if self.face_embedder is not None:
+                return list(self._embed_faces_locally(face_regions))
 
-            payload = {
-                "model": self.vision_model,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": f"""Compare these two facial feature descriptions and determine how similar they are:
+            if len(face_regions) == 1:
+                return [self.extract_face_features(face_regions[0])]
 
-Face 1 Features: {json.dumps(face1_features, indent=2)}
+            content = self._chat_completion(
+                self._cache_key(self.vision_model, _FEATURE_BATCH_PROMPT_TMPL, *face_regions),
+                lambda: self._face_features_batch_payload(face_regions)
+            )
 
-Face 2 Features: {json.dumps(face2_features, indent=2)}
+            if content is not None:
+                feature_list = self._parse_json(content, _JSON_ARRAY_RE)
+                if isinstance(feature_list, list):
+                    feature_list = feature_list[:len(face_regions)]
+                    return feature_list + [None] * (len(face_regions) - len(feature_list))
+                print("Error parsing AI batch response JSON")
+                return [None] * len(face_regions)
+            else:
+                return [None] * len(face_regions)
 
-Analyze the similarity based on:
-1. Facial structure and proportions
-2. Eye characteristics
-3. Nose features
-4. Mouth and lip features
-5. Overall facial geometry
-6. Distinctive features
+        except CacheMiss:
+            raise
+        except Exception as e:
+            print(f"Error extracting face features: {e}")
+            return [None] * len(face_regions)
 
-Provide a similarity score from 0.0 (completely different) to 1.0 (identical match).
-Consider a score above 0.7 as a likely match for the same person.
+    def compare_faces(self, face1_features, face2_features):
+        """
+        Compare two face feature sets
+        Embeddings are compared by cosine similarity; feature descriptions via OpenRouter AI
+        Returns similarity score between 0.0 and 1.0
+        """
+        try:
+            if face1_features is None or face2_features is None:
+                return 0.0
 
-Return only a JSON response:
-{{
-  "similarity_score": 0.85,
-  "confidence": 0.9,
-  "reasoning": "brief explanation of the comparison"
-}}"""
-                    }
-                ],
-                "max_tokens": 500,
-                "temperature": 0.1
-            }
-
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=30
+            embedding1 = self._as_embedding(face1_features)
+            embedding2 = self._as_embedding(face2_features)
+            if embedding1 is not None and embedding2 is not None:
+                # Both vectors are L2-normalized, so the dot product is the cosine similarity
+                return max(float(np.dot(embedding1, embedding2)), 0.0)
+            if embedding1 is not None or embedding2 is not None:
+                # An embedding can't be compared against a text description
+                return 0.0
+
+            if not face1_features or not face2_features:
+                return 0.0
+
+            payload = self._compare_faces_payload(face1_features, face2_features)
+            content = self._chat_completion(
+                self._cache_key(self.vision_model, payload["messages"][0]["content"]),
+                lambda: payload
             )
 
-            if response.status_code == 200:
-                result = response.json()
-                content = result['choices'][0]['message']['content']
-                
-                try:
-                    start_idx = content.find('{')
-                    end_idx = content.rfind('}') + 1
-                    if start_idx >= 0 and end_idx > start_idx:
-                        json_str = content[start_idx:end_idx]
-                        comparison_data = json.loads(json_str)
-                        return comparison_data.get('similarity_score', 0.0)
-                except json.JSONDecodeError:
+            if content is not None:
+                comparison_data = self._parse_json(content)
+                if not isinstance(comparison_data, dict):
                     return 0.0
+                return comparison_data.get('similarity_score', 0.0)
             else:
-                print(f"AI API Error: {response.status_code} - {response.text}")
                 return 0.0
 
+        except CacheMiss:
+            raise
         except Exception as e:
             print(f"Error comparing faces: {e}")
             return 0.0
 
-    def process_frame_for_faces(self, frame):
+    def compare_faces_many(self, face_features, candidate_features):
         """
-        Process a video frame to detect and extract faces
-        Returns list of face data with features
+        Compare one face against many stored feature sets
+        OpenRouter comparisons run concurrently, so the wait is the slowest call rather than the sum
+        Returns a list of similarity scores aligned with candidate_features
         """
+        if face_features is None or not candidate_features:
+            return [0.0] * len(candidate_features)
+
+        if self._as_embedding(face_features) is not None:
+            # Embedding comparisons are a dot product — no point in a thread hop. Recognition scores
+            # embeddings with FaceIndex instead, which keeps the enrolled matrix normalized once.
+            return [self.compare_faces(face_features, candidate) for candidate in candidate_features]
+
+        return list(self._executor.map(
+            lambda candidate: self.compare_faces(face_features, candidate),
+            candidate_features
+        ))
+
+    @staticmethod
+    def _frame_thumbnail(frame):
+        """64x48 grayscale thumbnail of a frame, for near-duplicate checks"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return cv2.resize(gray, (64, 48), interpolation=cv2.INTER_AREA)
+
+    def _is_near_duplicate(self, thumbnail):
+        """
+        True if a frame matches the last processed one closely enough to reuse its result
+        Any thumbnail pixel (a 10x10 block of a 640x480 frame) changing by FRAME_DIFF_THRESHOLD counts
+        as a change, so one new face in a still scene is enough; old results are never reused past
+        FRAME_REUSE_MAX_AGE seconds
+        """
+        with self._frame_cache_lock:
+            if self._last_thumbnail is None or self._last_thumbnail.shape != thumbnail.shape:
+                return False
+            if time.time() - self._last_processed_at > Config.FRAME_REUSE_MAX_AGE:
+                return False
+            return int(cv2.absdiff(thumbnail, self._last_thumbnail).max()) < Config.FRAME_DIFF_THRESHOLD
+
+    def enroll(self, embedding, student_id):
+        """Add a student's face embedding to the search index"""
+        self.face_index.add(embedding, student_id)
+
+    def identify(self, embedding, k=1):
+        """
+        Find the enrolled student whose embedding is closest to this one
+        Returns (student_id, similarity), with student_id None when nothing clears the match threshold
+        """
+        matches = self.face_index.search(embedding, k)
+        if not matches:
+            return None, 0.0
+
+        student_id, similarity = matches[0]
+        if similarity > self.match_threshold:
+            return student_id, similarity
+        return None, similarity
+
+    def identify_many(self, embeddings):
+        """
+        identify() for several faces at once
+        Returns a list of (student_id or None, similarity) aligned with embeddings
+        """
+        if not len(embeddings):
+            return []
+        return [(student_id if similarity > self.match_threshold else None, similarity)
+                for student_id, similarity in self.face_index.search_many(np.stack(embeddings))]
+
+    @staticmethod
+    def _bbox_iou(a, b):
+        """Intersection-over-union of two {x, y, width, height} boxes"""
+        ix = max(0.0, min(a['x'] + a['width'], b['x'] + b['width']) - max(a['x'], b['x']))
+        iy = max(0.0, min(a['y'] + a['height'], b['y'] + b['height']) - max(a['y'], b['y']))
+        intersection = ix * iy
+        union = a['width'] * a['height'] + b['width'] * b['height'] - intersection
+        return intersection / union if union > 0 else 0.0
+
+    def _reuse_tracked_features(self, bboxes):
+        """
+        Match this frame's face boxes against tracked faces by IOU
+        Returns a list aligned with bboxes: the track's features, or None for faces that need extraction
+        Ages are counted in processed frames. A track's features are only reused for
+        TRACK_REEXTRACT_AFTER frames after extraction, so a different person sitting down in the
+        same spot is not given the previous person's identity
+        """
+        features_list = []
+        with self._track_lock:
+            self._frame_count += 1
+            now = self._frame_count
+            self._tracks = [track for track in self._tracks
+                            if now - track['last_seen'] <= Config.TRACK_MAX_AGE]
+
+            claimed = set()
+            for bbox in bboxes:
+                best, best_iou = None, Config.TRACK_IOU_THRESHOLD
+                for i, track in enumerate(self._tracks):
+                    if i in claimed:
+                        continue
+                    try:
+                        iou = self._bbox_iou(bbox, track['bbox'])
+                    except (KeyError, TypeError):
+                        continue
+                    if iou > best_iou:
+                        best, best_iou = i, iou
+
+                if best is None:
+                    features_list.append(None)
+                    continue
+                claimed.add(best)
+                track = self._tracks[best]
+                if now - track['extracted_at'] >= Config.TRACK_REEXTRACT_AFTER:
+                    # Stale features: extract again; _start_tracks replaces this track
+                    features_list.append(None)
+                    continue
+                track['bbox'] = bbox
+                track['last_seen'] = now
+                features_list.append(track['features'])
+
+            # Drop stale tracks that were matched, their faces are about to be re-extracted
+            self._tracks = [track for i, track in enumerate(self._tracks)
+                            if i not in claimed or now - track['extracted_at'] < Config.TRACK_REEXTRACT_AFTER]
+        return features_list
+
+    def _start_tracks(self, faces):
+        """Begin tracking newly extracted faces, given as (bbox, features) pairs"""
+        with self._track_lock:
+            now = self._frame_count
+            for bbox, features in faces:
+                if features is not None:
+                    self._tracks.append({'bbox': bbox, 'features': features,
+                                         'extracted_at': now, 'last_seen': now})
+
+    def _detect_stage(self, frame):
+        """
+        First half of process_frame_for_faces: detect and crop the faces of a frame
+        Returns (thumbnail, [(face, face_region)]), or None for a near-duplicate of the last processed frame
+        Near-duplicates are only skipped when detection would cost an OpenRouter call; local YuNet
+        detection is cheap enough to run on every frame
+        """
+        thumbnail = None
+        if self.face_detector is None and Config.FRAME_DIFF_THRESHOLD > 0:
+            thumbnail = self._frame_thumbnail(frame)
+            if self._is_near_duplicate(thumbnail):
+                return None
+
         faces = self.detect_faces_in_image(frame)
-        processed_faces = []
-        
-        # Get frame dimensions
-        height, width = frame.shape[:2]
+        detected = []
         
         for face in faces:
             try:
-                # Extract face region based on bounding box
-                bbox = face.get('bbox', {})
-                x = int(bbox.get('x', 0) * width)
-                y = int(bbox.get('y', 0) * height)
-                w = int(bbox.get('width', 0) * width)
-                h = int(bbox.get('height', 0) * height)
-                
-                # Extract face region
-                face_region = frame[y:y+h, x:x+w]
+                # Extract face region (aligned on its landmarks for the local embedder)
+                face_region = self._face_crop(frame, face)
                 
-                if face_region.size > 0:
-                    # Extract features for this face
-                    features = self.extract_face_features(face_region)
-                    
-                    processed_faces.append({
-                        'bbox': bbox,
-                        'confidence': face.get('confidence', 0.0),
-                        'features': features,
-                        'face_region': face_region
-                    })
+                if face_region is not None:
+                    detected.append((face, face_region))
             except Exception as e:
                 print(f"Error processing face: {e}")
                 continue
+
+        return thumbnail, detected
+
+    def _extract_stage(self, detection):
+        """
+        Second half of process_frame_for_faces: extract features for the faces found by _detect_stage
+        Returns list of face data with features
+        """
+        if detection is None:
+            with self._frame_cache_lock:
+                return self._last_processed_faces
+        thumbnail, detected = detection
+
+        # Faces that overlap a tracked face reuse its features; only new faces are extracted
+        features_list = self._reuse_tracked_features([face.get('bbox', {}) for face, _ in detected])
+        pending = [i for i, features in enumerate(features_list) if features is None]
+
+        # Extract features for all new faces of this frame in one call. Crops sent to OpenRouter are
+        # shrunk first so large faces don't cost extra encode time and upload bytes; the local embedder
+        # gets them untouched and does its own single resize to its input size.
+        crops = [detected[i][1] for i in pending]
+        if self.face_embedder is None:
+            crops = [cv2.resize(crop, FACE_CROP_SIZE, interpolation=cv2.INTER_AREA) for crop in crops]
+        new_features = self.extract_face_features_batch(crops)
+        for i, features in zip(pending, new_features):
+            features_list[i] = features
+        self._start_tracks([(detected[i][0].get('bbox', {}), features_list[i]) for i in pending])
+
+        processed_faces = []
+        for (face, face_region), features in zip(detected, features_list):
+            processed_faces.append({
+                'bbox': face.get('bbox', {}),
+                'confidence': face.get('confidence', 0.0),
+                'features': features,
+                'face_region': face_region
+            })
+
+        with self._frame_cache_lock:
+            self._last_thumbnail = thumbnail
+            self._last_processed_at = time.time()
+            self._last_processed_faces = processed_faces
         
-        return processed_faces
\ No newline at end of file
+        return processed_faces
+
+    def process_frame_for_faces(self, frame):
+        """
+        Process a video frame to detect and extract faces
+        Frames that are near-duplicates of the previous one reuse its result, and faces
+        that overlap a tracked face reuse its features
+        Returns list of face data with features
+        """
+        return self._extract_stage(self._detect_stage(frame))
+
+
+class FramePipeline:
+    """
+    Runs process_frame_for_faces as two stages on their own threads (detect | extract features)
+    so consecutive frames overlap: while one frame's features are extracted, the next is
+    already being detected. Queues between stages are bounded and drop their oldest item
+    when full, so a slow stage skips stale frames instead of falling behind.
+    """
+
+    def __init__(self, service, maxsize=2):
+        self.service = service
+        self.frames = queue.Queue(maxsize=maxsize)
+        self.detections = queue.Queue(maxsize=maxsize)
+        self.results = queue.Queue(maxsize=maxsize)
+        # Each start() gets its own stop event, so stopping one run never touches a newer one
+        self._run = None
+        self._run_lock = threading.Lock()
+
+    @staticmethod
+    def _put_latest(q, item):
+        """Put item on a bounded queue, discarding the oldest entry if it is full"""
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def start(self):
+        """
+        Start a new run of the stage threads and return its handle for stop()
+        Any earlier run still going is told to stop, so only one set of stage threads consumes frames
+        """
+        running = threading.Event()
+        running.set()
+        threads = [
+            threading.Thread(target=self._run_stage,
+                             args=(running, self.frames, self.detections, self.service._detect_stage),
+                             daemon=True),
+            threading.Thread(target=self._run_stage,
+                             args=(running, self.detections, self.results, self.service._extract_stage),
+                             daemon=True),
+        ]
+        with self._run_lock:
+            if self._run is not None:
+                self._run[0].clear()
+            self._run = (running, threads)
+        for thread in threads:
+            thread.start()
+        return self._run
+
+    def stop(self, run):
+        """Stop the stage threads of one run; queued frames are discarded unless a newer run owns them"""
+        running, threads = run
+        running.clear()
+        for thread in threads:
+            thread.join(timeout=5)
+        with self._run_lock:
+            if self._run is not run:
+                return
+            self._run = None
+        for q in (self.frames, self.detections, self.results):
+            while True:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+
+    def submit(self, frame):
+        """Queue a frame for processing; the oldest waiting frame is dropped if the pipeline is busy"""
+        self._put_latest(self.frames, frame)
+
+    def get(self, timeout=None):
+        """Next processed frame's face list; raises queue.Empty on timeout"""
+        return self.results.get(timeout=timeout)
+
+    def drain(self):
+        """Face lists of every processed frame that is ready now, without waiting"""
+        ready = []
+        while True:
+            try:
+                ready.append(self.results.get_nowait())
+            except queue.Empty:
+                return ready
+
+    def _run_stage(self, running, inbox, outbox, stage):
+        while running.is_set():
+            try:
+                item = inbox.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._put_latest(outbox, stage(item))
+            except Exception as e:
+                print(f"Frame pipeline error: {e}")
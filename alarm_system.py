@@ -1,11 +1,16 @@
 import os
+import queue
 import threading
 import time
 from datetime import datetime
 import pygame
-import json
+import orjson
+from collections import deque
 from config import Config
 
+ALARM_LOG_FILE = os.path.join("logs", "alarm_log.jsonl")
+ALARM_LOG_MAX_BYTES = 256 * 1024  # rotate to alarm_log.jsonl.1 past this size
+
 class AlarmSystem:
     def __init__(self):
         self.is_active = False
@@ -19,6 +24,31 @@ class AlarmSystem:
         except:
             self.audio_available = False
             print("Warning: Audio system not available. Using visual alerts only.")
+        
+        # Decode the alarm sound once instead of reloading it on every alarm iteration
+        self._alarm_sound = self._load_alarm_sound() if self.audio_available else None
+        
+        # Log writes and notifications run on a background worker so they never delay the alarm
+        self._io_queue = queue.Queue()
+        self._io_thread = threading.Thread(target=self._io_worker, daemon=True)
+        self._io_thread.start()
+    
+    def _io_worker(self):
+        """
+        Drain queued log entries and notifications off the alarm thread
+        """
+        handlers = {
+            "log": self._write_alarm_log,
+            "notify": self._deliver_notification
+        }
+        while True:
+            kind, data = self._io_queue.get()
+            try:
+                handlers[kind](data)
+            except Exception as e:
+                print(f"Alarm I/O error ({kind}): {e}")
+            finally:
+                self._io_queue.task_done()
     
     def trigger_alarm(self, alert_type="unknown_person", message="Unknown person detected", severity="high"):
         """
@@ -71,16 +101,26 @@ class AlarmSystem:
         # Auto-stop after duration
         self.is_active = False
     
+    def _load_alarm_sound(self):
+        """
+        Load the alarm sound file into memory, or return None if it is missing
+        """
+        alarm_path = self.config.ALARM_SOUND_PATH
+        if not os.path.exists(alarm_path):
+            return None
+        try:
+            return pygame.mixer.Sound(alarm_path)
+        except Exception as e:
+            print(f"Error loading alarm sound: {e}")
+            return None
+    
     def _play_alarm_sound(self, severity):
         """
         Play alarm sound based on severity
         """
         try:
-            # Check if alarm file exists
-            alarm_path = self.config.ALARM_SOUND_PATH
-            if os.path.exists(alarm_path):
-                pygame.mixer.music.load(alarm_path)
-                pygame.mixer.music.play()
+            if self._alarm_sound is not None:
+                self._alarm_sound.play()
             else:
                 # Generate beep sound if no audio file
                 self._generate_beep_sound(severity)
@@ -136,10 +176,8 @@ class AlarmSystem:
     
     def _send_notifications(self, alert_type, message, severity):
         """
-        Send notifications via email/webhook (placeholder)
+        Queue a notification for the I/O worker
         """
-        # This would implement actual notification sending
-        # For now, just log the notification
         notification_data = {
             "timestamp": datetime.now().isoformat(),
             "alert_type": alert_type,
@@ -147,13 +185,21 @@ class AlarmSystem:
             "severity": severity,
             "recipient": self.config.ALERT_EMAIL
         }
+        self._io_queue.put(("notify", notification_data))
+    
+    def _deliver_notification(self, notification_data):
+        """
+        Send notifications via email/webhook (placeholder)
+        """
+        # This would implement actual notification sending
+        # For now, just log the notification
         
         # In a real implementation, you would:
         # 1. Send email using SMTP
         # 2. Send webhook to external systems
         # 3. Send push notifications
         
-        print(f"📧 Notification sent to: {self.config.ALERT_EMAIL}")
+        print(f"📧 Notification sent to: {notification_data['recipient']}")
     
     def _get_alarm_duration(self, severity):
         """
@@ -168,42 +214,31 @@ class AlarmSystem:
     
     def _log_alarm(self, alert_type, message, severity):
         """
-        Log alarm activation to file
+        Queue an alarm activation entry for the I/O worker
+        """
+        log_entry = {
+            "timestamp": datetime.now().isoformat(),
+            "alert_type": alert_type,
+            "message": message,
+            "severity": severity,
+            "status": "activated"
+        }
+        self._io_queue.put(("log", log_entry))
+    
+    def _write_alarm_log(self, log_entry):
+        """
+        Log alarm activation to file (one JSON object per line, append-only)
         """
         try:
-            log_entry = {
-                "timestamp": datetime.now().isoformat(),
-                "alert_type": alert_type,
-                "message": message,
-                "severity": severity,
-                "status": "activated"
-            }
-            
             # Ensure logs directory exists
-            logs_dir = "logs"
-            os.makedirs(logs_dir, exist_ok=True)
+            os.makedirs(os.path.dirname(ALARM_LOG_FILE), exist_ok=True)
             
-            # Write to log file
-            log_file = os.path.join(logs_dir, "alarm_log.json")
+            # Rotate instead of rewriting the whole history on every alarm
+            if os.path.exists(ALARM_LOG_FILE) and os.stat(ALARM_LOG_FILE).st_size > ALARM_LOG_MAX_BYTES:
+                os.replace(ALARM_LOG_FILE, ALARM_LOG_FILE + ".1")
             
-            # Read existing logs
-            logs = []
-            if os.path.exists(log_file):
-                try:
-                    with open(log_file, 'r') as f:
-                        logs = json.load(f)
-                except:
-                    logs = []
-            
-            # Add new log entry
-            logs.append(log_entry)
-            
-            # Keep only last 1000 entries
-            logs = logs[-1000:]
-            
-            # Write back to file
-            with open(log_file, 'w') as f:
-                json.dump(logs, f, indent=2)
+            with open(ALARM_LOG_FILE, 'ab') as f:
+                f.write(orjson.dumps(log_entry) + b"\n")
                 
         except Exception as e:
             print(f"Error logging alarm: {e}")
@@ -213,12 +248,20 @@ class AlarmSystem:
         Get alarm history from log file
         """
         try:
-            log_file = os.path.join("logs", "alarm_log.json")
-            if os.path.exists(log_file):
-                with open(log_file, 'r') as f:
-                    logs = json.load(f)
-                return logs[-limit:] if logs else []
-            return []
+            if not os.path.exists(ALARM_LOG_FILE):
+                return []
+            
+            # Only the last `limit` lines are kept in memory
+            with open(ALARM_LOG_FILE, 'rb') as f:
+                lines = deque(f, maxlen=limit)
+            
+            logs = []
+            for line in lines:
+                try:
+                    logs.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    continue
+            return logs
         except Exception as e:
             print(f"Error reading alarm history: {e}")
             return []
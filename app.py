@@ -1,73 +1,196 @@
 from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from flask_sock import Sock
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
 from werkzeug.utils import secure_filename
 import os
 import cv2
 import json
+import orjson
 import base64
+import hashlib
 import numpy as np
 from datetime import datetime, timedelta
 import threading
+import queue
 import time
 
 from config import Config
-from models import db, Student, EntryLog, SystemAlert
-from ai_service import AIService
+from models import db, Student, EntryLog, SystemAlert, upgrade_legacy_students
+from ai_service import AIService, FramePipeline
 from alarm_system import trigger_security_alarm, stop_security_alarm
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson — serializes numpy values and writes response bytes directly"""
+    option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.option), mimetype=self.mimetype
+        )
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config.from_object(Config)
 Config.init_app(app)
 
+if app.config['JINJA_BYTECODE_CACHE_DIR']:
+    os.makedirs(app.config['JINJA_BYTECODE_CACHE_DIR'], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+
 # Initialize extensions
 db.init_app(app)
 CORS(app)
+sock = Sock(app)
+
+@app.after_request
+def _x_accel_redirect(response):
+    """nginx doesn't understand X-Sendfile — translate it to an X-Accel-Redirect internal URI"""
+    prefix = app.config['X_ACCEL_REDIRECT_PREFIX']
+    path = response.headers.get('X-Sendfile')
+    if prefix and path:
+        del response.headers['X-Sendfile']
+        relative = os.path.relpath(path, app.static_folder).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative
+    return response
 
 # Initialize AI service
 ai_service = AIService()
 
+# Detect and feature-extraction stages run on their own threads while monitoring
+frame_pipeline = FramePipeline(ai_service)
+
 # Global variables for monitoring
-monitoring_active = False
+monitoring_active = threading.Event()   # set while monitoring runs
 monitoring_thread = None
 capture_thread = None   # Dedicated camera-read thread
 camera = None
 
+# Enrolled students' encodings, parsed once and rebuilt on next use after students change.
+# Numeric embeddings live in ai_service.face_index; OpenRouter feature descriptions are kept here.
+ENCODING_CACHE = {
+    'version': 0,       # bumped whenever students change
+    'built': -1,        # version the cache was last built from
+    'descriptors': []   # (student id, feature description) pairs
+}
+
+# Recognition results produced by the monitoring thread, handed to the next /analyze_frame call
+pending_results = []
+pending_faces_detected = 0
+results_lock = threading.Lock()
+
+# Dashboard stats are recomputed at most once per STATS_REFRESH_INTERVAL and shared by every poller
+STATS_REFRESH_INTERVAL = 1.0
+_stats_cache = {'ts': 0.0, 'data': None}
+stats_lock = threading.Lock()
+
 # Shared frame buffer — only the capture thread writes; everyone else reads
 latest_frame = None
-latest_frame_b64 = None
+latest_frame_id = 0     # bumped for every captured frame
 frame_lock = threading.Lock()
 
+# Latest frame encoded on demand by /get_camera_frame, reused until a new frame arrives
+encoded_frame = {'id': -1, 'b64': None}
+encode_lock = threading.Lock()
+
 def allowed_file(filename):
     """Check if file has allowed extension"""
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _invalidate_encoding_cache():
+    """Mark the cached student encodings stale"""
+    ENCODING_CACHE['version'] += 1
+
+def _rebuild_encoding_cache():
+    """Reload enrolled student encodings if students changed since the last build"""
+    version = ENCODING_CACHE['version']
+    if ENCODING_CACHE['built'] == version:
+        return
+
+    vectors, student_ids, descriptors = [], [], []
+    rows = db.session.query(Student.id, Student.face_encoding, Student.face_features).filter(
+        Student.is_active.is_(True)
+    )
+    for student_id, face_encoding, face_features in rows:
+        if face_encoding:
+            if not isinstance(face_encoding, bytes) or len(face_encoding) % 4:
+                # Legacy JSON text (see upgrade_legacy_students) — one bad row must not fail every frame
+                print(f"Skipping student {student_id}: face_encoding is not float32 bytes")
+                continue
+            vectors.append(np.frombuffer(face_encoding, dtype=np.float32))
+            student_ids.append(student_id)
+        elif face_features:
+            try:
+                descriptors.append((student_id, json.loads(face_features)))
+            except ValueError:
+                continue
+
+    ai_service.face_index.replace(vectors, student_ids)
+    ENCODING_CACHE['descriptors'] = descriptors
+    ENCODING_CACHE['built'] = version
+
+def _dashboard_counts():
+    """
+    Active student count and today's (UTC) entry count in a single statement
+    Today is a range filter on entry_time, so its index is used
+    """
+    midnight = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    total_students = select(func.count()).select_from(Student).where(
+        Student.is_active.is_(True)
+    ).scalar_subquery()
+    today_entries = select(func.count()).select_from(EntryLog).where(
+        EntryLog.entry_time >= midnight,
+        EntryLog.entry_time < midnight + timedelta(days=1)
+    ).scalar_subquery()
+    return db.session.execute(select(total_students, today_entries)).one()
+
+def _recent_entries(limit):
+    """Newest entry logs with their students loaded in the same query"""
+    return EntryLog.query.options(joinedload(EntryLog.student)).order_by(
+        EntryLog.entry_time.desc()
+    ).limit(limit).all()
+
+def _conditional_json(payload):
+    """
+    jsonify for polled endpoints: tagged with an ETag of the body and cacheable for one second,
+    so an unchanged repeat poll is answered with an empty 304
+    """
+    response = jsonify(payload)
+    response.set_etag(hashlib.blake2b(response.get_data(), digest_size=8).hexdigest())
+    response.headers['Cache-Control'] = 'max-age=1, must-revalidate'
+    return response.make_conditional(request)
+
 @app.route('/')
 def index():
     """Main dashboard page"""
     # Get recent entry logs
-    recent_entries = EntryLog.query.order_by(EntryLog.entry_time.desc()).limit(10).all()
+    recent_entries = _recent_entries(10)
     
     # Get active alerts
     active_alerts = SystemAlert.query.filter_by(is_resolved=False).order_by(
         SystemAlert.created_at.desc()
     ).limit(5).all()
     
-    # Get student count
-    total_students = Student.query.filter_by(is_active=True).count()
-    
-    # Get today's entries
-    today = datetime.utcnow().date()
-    today_entries = EntryLog.query.filter(
-        db.func.date(EntryLog.entry_time) == today
-    ).count()
+    # Get student count and today's entries
+    total_students, today_entries = _dashboard_counts()
     
     return render_template('index.html', 
                          recent_entries=recent_entries,
                          active_alerts=active_alerts,
                          total_students=total_students,
                          today_entries=today_entries,
-                         monitoring_active=monitoring_active)
+                         monitoring_active=monitoring_active.is_set())
 
 @app.route('/students')
 def students():
@@ -122,11 +245,14 @@ def add_student():
                 )
                 
                 # Store face features
-                if features:
-                    student.face_encoding = json.dumps(features)
+                if isinstance(features, np.ndarray):
+                    student.set_face_encoding(features)
+                elif features:
+                    student.set_face_features(features)
                 
                 db.session.add(student)
                 db.session.commit()
+                _invalidate_encoding_cache()
                 
                 flash('Student added successfully!', 'success')
                 return redirect(url_for('students'))
@@ -146,6 +272,7 @@ def delete_student(student_id):
         student = Student.query.get_or_404(student_id)
         student.is_active = False
         db.session.commit()
+        _invalidate_encoding_cache()
         flash('Student deleted successfully!', 'success')
     except Exception as e:
         flash(f'Error deleting student: {str(e)}', 'error')
@@ -156,11 +283,18 @@ def delete_student(student_id):
 @app.route('/start_monitoring', methods=['POST'])
 def start_monitoring():
     """Start monitoring — browser will supply frames via /analyze_frame."""
-    global monitoring_active, monitoring_thread
+    global monitoring_thread
 
     try:
-        if not monitoring_active:
-            monitoring_active = True
+        if not monitoring_active.is_set():
+            # A just-stopped monitoring thread sees the cleared event and exits within a second;
+            # don't re-arm until it has, or two monitors would share the event and the pipeline
+            if monitoring_thread is not None:
+                monitoring_thread.join(timeout=2)
+                if monitoring_thread.is_alive():
+                    return jsonify({'status': 'info',
+                                    'message': 'Previous monitoring session is still stopping — try again in a moment'})
+            monitoring_active.set()
 
             # Start the AI monitoring thread (reads frames posted by the browser)
             monitoring_thread = threading.Thread(target=monitor_faces, daemon=True)
@@ -174,15 +308,14 @@ def start_monitoring():
             return jsonify({'status': 'info', 'message': 'Monitoring already active'})
 
     except Exception as e:
-        monitoring_active = False
+        monitoring_active.clear()
         return jsonify({'status': 'error', 'message': str(e)})
 
 @app.route('/stop_monitoring', methods=['POST'])
 def stop_monitoring():
     """Stop monitoring."""
-    global monitoring_active
     try:
-        monitoring_active = False
+        monitoring_active.clear()
         return jsonify({'status': 'success', 'message': 'Monitoring stopped'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error stopping: {str(e)}'})
@@ -193,21 +326,20 @@ def _capture_loop():
     ONLY this function ever calls camera.read() — prevents the race condition
     that was causing the camera to crash when two threads read simultaneously.
     """
-    global monitoring_active, camera, latest_frame, latest_frame_b64
+    global camera, latest_frame, latest_frame_id
 
     print("📷 Capture loop started")
     consecutive_failures = 0
 
-    while monitoring_active and camera and camera.isOpened():
+    while monitoring_active.is_set() and camera and camera.isOpened():
         try:
             ret, frame = camera.read()
             if ret and frame is not None and frame.size > 0:
                 consecutive_failures = 0
-                _, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-                b64 = base64.b64encode(buf).decode('utf-8')
+                # camera.read() returns a fresh buffer each call, so no copy is needed
                 with frame_lock:
-                    latest_frame = frame.copy()
-                    latest_frame_b64 = b64
+                    latest_frame = frame
+                    latest_frame_id += 1
             else:
                 consecutive_failures += 1
                 if consecutive_failures > 30:   # ~3 s of failures
@@ -225,12 +357,26 @@ def _capture_loop():
     print("📷 Capture loop exited")
 
 
+def _latest_frame_b64():
+    """Base64 JPEG of the latest captured frame, encoded only when a new frame has arrived"""
+    with frame_lock:
+        frame, frame_id = latest_frame, latest_frame_id
+    if frame is None:
+        return None
+
+    with encode_lock:
+        if encoded_frame['id'] != frame_id:
+            _, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+            encoded_frame['b64'] = base64.b64encode(buf).decode('utf-8')
+            encoded_frame['id'] = frame_id
+        return encoded_frame['b64']
+
+
 @app.route('/get_camera_frame')
 def get_camera_frame():
     """Return the latest captured frame from the shared buffer (no camera.read() here)."""
     try:
-        with frame_lock:
-            b64 = latest_frame_b64
+        b64 = _latest_frame_b64()
 
         if b64:
             return jsonify({
@@ -248,9 +394,10 @@ def get_camera_frame():
 @app.route('/monitoring_status')
 def monitoring_status():
     """Get current monitoring status"""
-    return jsonify({
-        'active': monitoring_active,
-        'timestamp': datetime.utcnow().isoformat()
+    return _conditional_json({
+        'active': monitoring_active.is_set(),
+        # Whole seconds, so polls within the same second share an ETag
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds')
     })
 
 @app.route('/entry_logs')
@@ -259,7 +406,7 @@ def entry_logs():
     page = request.args.get('page', 1, type=int)
     per_page = 20
     
-    logs = EntryLog.query.order_by(EntryLog.entry_time.desc()).paginate(
+    logs = EntryLog.query.options(joinedload(EntryLog.student)).order_by(EntryLog.entry_time.desc()).paginate(
         page=page, per_page=per_page, error_out=False
     )
     
@@ -298,37 +445,41 @@ def stop_alarm():
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error stopping alarm: {str(e)}'})
 
+def _compute_stats():
+    """Query the dashboard statistics (everything except the live monitoring flag)"""
+    # Get active alerts
+    active_alerts = SystemAlert.query.filter_by(is_resolved=False).order_by(
+        SystemAlert.created_at.desc()
+    ).limit(5).all()
+    
+    # Get student count and today's entries
+    total_students, today_entries = _dashboard_counts()
+    
+    # Get recent entries
+    recent_entries = _recent_entries(5)
+    
+    return {
+        'total_students': total_students,
+        'today_entries': today_entries,
+        'active_alerts_count': len(active_alerts),
+        'recent_entries': [entry.to_dict() for entry in recent_entries],
+        'active_alerts': [alert.to_dict() for alert in active_alerts]
+    }
+
 @app.route('/dashboard_stats')
 def dashboard_stats():
-    """Get real-time dashboard statistics"""
+    """Get real-time dashboard statistics (read-through cache shared by every poller)"""
     try:
-        # Get active alerts
-        active_alerts = SystemAlert.query.filter_by(is_resolved=False).order_by(
-            SystemAlert.created_at.desc()
-        ).limit(5).all()
-        
-        # Get student count
-        total_students = Student.query.filter_by(is_active=True).count()
-        
-        # Get today's entries
-        today = datetime.utcnow().date()
-        today_entries = EntryLog.query.filter(
-            db.func.date(EntryLog.entry_time) == today
-        ).count()
+        # Pollers arriving while the stats are being recomputed wait for that result instead of querying too
+        with stats_lock:
+            if _stats_cache['data'] is None or time.time() - _stats_cache['ts'] >= STATS_REFRESH_INTERVAL:
+                _stats_cache['data'] = _compute_stats()
+                _stats_cache['ts'] = time.time()
+            data = _stats_cache['data']
         
-        # Get recent entries
-        recent_entries = EntryLog.query.order_by(EntryLog.entry_time.desc()).limit(5).all()
-        
-        return jsonify({
+        return _conditional_json({
             'status': 'success',
-            'data': {
-                'total_students': total_students,
-                'today_entries': today_entries,
-                'active_alerts_count': len(active_alerts),
-                'monitoring_active': monitoring_active,
-                'recent_entries': [entry.to_dict() for entry in recent_entries],
-                'active_alerts': [alert.to_dict() for alert in active_alerts]
-            }
+            'data': dict(data, monitoring_active=monitoring_active.is_set())
         })
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error getting stats: {str(e)}'})
@@ -338,8 +489,8 @@ def clear_all_data():
     """Clear all system data (alerts, logs, etc.)"""
     try:
         # Stop monitoring and alarms first
-        global monitoring_active, camera
-        monitoring_active = False
+        global camera
+        monitoring_active.clear()
         if camera:
             camera.release()
             camera = None
@@ -355,6 +506,7 @@ def clear_all_data():
         
         # Commit changes
         db.session.commit()
+        _invalidate_encoding_cache()
         
         print("All system data cleared successfully")
         return jsonify({'status': 'success', 'message': 'All data cleared successfully'})
@@ -387,8 +539,8 @@ def system_reset():
     """Reset entire system to clean state"""
     try:
         # Stop everything
-        global monitoring_active, camera
-        monitoring_active = False
+        global camera
+        monitoring_active.clear()
         if camera:
             camera.release()
             camera = None
@@ -414,103 +566,223 @@ def system_reset():
 @app.route('/analyze_frame', methods=['POST'])
 def analyze_frame():
     """
-    Receive a camera frame (base64 JPEG) from the browser and run face recognition on it.
-    The browser captures via getUserMedia, encodes to base64, and POSTs here every few seconds.
+    Receive a camera frame from the browser and queue it for face recognition.
+    The frame is either the raw JPEG request body (image/jpeg or application/octet-stream)
+    or JSON {"frame": <base64 JPEG>}.
+    Recognition runs in the monitoring thread; the response carries whatever it finished since the last call.
+    The dashboard normally streams frames over /ws/frames instead; this is its fallback.
     """
-    if not monitoring_active:
-        return jsonify({'status': 'skipped', 'message': 'Monitoring not active'})
+    # Refuse before touching the body; Connection: close lets the client abandon the upload
+    if not monitoring_active.is_set():
+        response = jsonify({'status': 'skipped', 'message': 'Monitoring not active'})
+        response.status_code = 503
+        response.headers['Connection'] = 'close'
+        return response
+
+    if request.content_length and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        response = jsonify({'status': 'error', 'message': 'Frame too large'})
+        response.status_code = 413
+        response.headers['Connection'] = 'close'
+        return response
 
     try:
-        data = request.get_json()
-        if not data or 'frame' not in data:
-            return jsonify({'status': 'error', 'message': 'No frame data received'})
-
-        frame_b64 = data['frame']
-
-        # Decode base64 → numpy array
-        img_bytes = base64.b64decode(frame_b64)
-        img_array = np.frombuffer(img_bytes, dtype=np.uint8)
-        frame = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+        # Bodies are read once and not cached on the request — they're only needed for the decode
+        if request.is_json:
+            data = request.get_json(cache=False)
+            if not data or 'frame' not in data:
+                return jsonify({'status': 'error', 'message': 'No frame data received'})
+            img_bytes = base64.b64decode(data['frame'])
+        else:
+            img_bytes = request.get_data(cache=False)
+            if not img_bytes:
+                return jsonify({'status': 'error', 'message': 'No frame data received'})
 
-        if frame is None or frame.size == 0:
+        if not _submit_frame(img_bytes):
             return jsonify({'status': 'error', 'message': 'Could not decode frame'})
 
-        current_time = datetime.utcnow()
-
-        # Run AI face detection
-        detected_faces = ai_service.process_frame_for_faces(frame)
-
-        results = []
-
-        for face_data in detected_faces:
-            matched_student = None
-            best_match_score = 0.0
-
-            if face_data.get('features'):
-                students = Student.query.filter_by(is_active=True).all()
-
-                for student in students:
-                    if student.face_encoding:
-                        stored_features = json.loads(student.face_encoding)
-                        similarity = ai_service.compare_faces(
-                            face_data['features'],
-                            stored_features
-                        )
-                        if similarity > best_match_score and similarity > 0.75:
-                            best_match_score = similarity
-                            matched_student = student
-
-            # Log this detection
-            entry_log = EntryLog(
-                student_id=matched_student.id if matched_student else None,
-                is_recognized=matched_student is not None,
-                confidence_score=best_match_score if best_match_score > 0 else None,
-                entry_time=current_time
-            )
-            db.session.add(entry_log)
-
-            if matched_student:
-                print(f"✅ Recognized: {matched_student.name} ({best_match_score:.2f})")
-                results.append({'recognized': True, 'name': matched_student.name, 'confidence': best_match_score})
-            else:
-                print("❌ Unknown person detected!")
-                # Create security alert
-                alert = SystemAlert(
-                    alert_type='unknown_person',
-                    message=f'Unknown person detected at {current_time.strftime("%Y-%m-%d %H:%M:%S")}',
-                    severity='high'
-                )
-                db.session.add(alert)
-                trigger_security_alarm(
-                    alert_type='unknown_person',
-                    message=f'Unknown person detected at {current_time.strftime("%Y-%m-%d %H:%M:%S")}',
-                    severity='high'
-                )
-                results.append({'recognized': False, 'name': 'Unknown'})
-
-        db.session.commit()
-
+        faces_detected, results = _take_results()
         return jsonify({
             'status': 'success',
-            'faces_detected': len(detected_faces),
+            'faces_detected': faces_detected,
             'results': results
         })
 
     except Exception as e:
-        db.session.rollback()
         print(f"analyze_frame error: {e}")
         return jsonify({'status': 'error', 'message': str(e)})
 
 
+@sock.route('/ws/frames')
+def ws_frames(ws):
+    """
+    Persistent frame upload: the browser sends each frame as a binary JPEG message and gets back
+    the same JSON /analyze_frame returns, without an HTTP request per frame.
+    """
+    while True:
+        message = ws.receive()
+        try:
+            if not monitoring_active.is_set():
+                reply = {'status': 'skipped', 'message': 'Monitoring not active'}
+            elif not isinstance(message, bytes) or not message:
+                reply = {'status': 'error', 'message': 'Expected a binary JPEG frame'}
+            elif len(message) > app.config['MAX_CONTENT_LENGTH']:
+                reply = {'status': 'error', 'message': 'Frame too large'}
+            elif not _submit_frame(message):
+                reply = {'status': 'error', 'message': 'Could not decode frame'}
+            else:
+                faces_detected, results = _take_results()
+                reply = {'status': 'success', 'faces_detected': faces_detected, 'results': results}
+        except Exception as e:
+            print(f"ws_frames error: {e}")
+            reply = {'status': 'error', 'message': str(e)}
+        ws.send(app.json.dumps(reply))
+
+
+def _submit_frame(img_bytes):
+    """Decode a JPEG frame and queue it for recognition; returns False if it can't be decoded"""
+    # Wrap the bytes without copying, then decode
+    img_array = np.frombuffer(img_bytes, dtype=np.uint8)
+    frame = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+
+    if frame is None or frame.size == 0:
+        return False
+
+    # Detection cost grows with pixel count; face boxes are normalized, so no rescaling is needed after
+    max_width = Config.ANALYZE_MAX_WIDTH
+    if max_width and frame.shape[1] > max_width:
+        scale = max_width / frame.shape[1]
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    frame_pipeline.submit(frame)
+    return True
+
+
+def _take_results():
+    """Recognition results finished since the last call, as (faces_detected, results)"""
+    global pending_results, pending_faces_detected
+
+    with results_lock:
+        results, pending_results = pending_results, []
+        faces_detected, pending_faces_detected = pending_faces_detected, 0
+    return faces_detected, results
+
+
+def _recognize_faces(detected_faces):
+    """
+    Match detected faces against enrolled students, logging entries and raising alerts for unknowns
+    The new rows are added to the session; the caller commits
+    """
+    current_time = datetime.utcnow()
+    unknown_message = f'Unknown person detected at {current_time.strftime("%Y-%m-%d %H:%M:%S")}'
+    results = []
+    new_logs = []
+    new_alerts = []
+
+    _rebuild_encoding_cache()
+
+    # Embeddings: every face of the frame is searched against every enrolled student in one product
+    embedded = [i for i, face_data in enumerate(detected_faces)
+                if isinstance(face_data.get('features'), np.ndarray)]
+    identities = dict(zip(embedded, ai_service.identify_many(
+        [detected_faces[i]['features'] for i in embedded]
+    )))
+
+    for i, face_data in enumerate(detected_faces):
+        matched_student = None
+        best_match_score = 0.0
+
+        if i in identities:
+            student_id, similarity = identities[i]
+            if student_id is not None:
+                matched_student = db.session.get(Student, student_id)
+                best_match_score = similarity
+
+        elif face_data.get('features') is not None:
+            descriptors = ENCODING_CACHE['descriptors']
+
+            # Score against every enrolled student at once (concurrent for OpenRouter comparisons)
+            similarities = ai_service.compare_faces_many(
+                face_data['features'],
+                [descriptor for _, descriptor in descriptors]
+            )
+
+            best_student_id = None
+            for (student_id, _), similarity in zip(descriptors, similarities):
+                if similarity > best_match_score and similarity > ai_service.match_threshold:
+                    best_match_score = similarity
+                    best_student_id = student_id
+            if best_student_id is not None:
+                matched_student = db.session.get(Student, best_student_id)
+
+        # Log this detection
+        entry_log = EntryLog(
+            student_id=matched_student.id if matched_student else None,
+            is_recognized=matched_student is not None,
+            confidence_score=best_match_score if best_match_score > 0 else None,
+            entry_time=current_time
+        )
+        new_logs.append(entry_log)
+
+        if matched_student:
+            print(f"✅ Recognized: {matched_student.name} ({best_match_score:.2f})")
+            results.append({'recognized': True, 'name': matched_student.name, 'confidence': best_match_score})
+        else:
+            print("❌ Unknown person detected!")
+            # Create security alert
+            alert = SystemAlert(
+                alert_type='unknown_person',
+                message=unknown_message,
+                severity='high'
+            )
+            new_alerts.append(alert)
+            trigger_security_alarm(
+                alert_type='unknown_person',
+                message=unknown_message,
+                severity='high'
+            )
+            results.append({'recognized': False, 'name': 'Unknown'})
+
+    # One executemany INSERT per table instead of a unit-of-work flush per object
+    db.session.bulk_save_objects(new_logs)
+    db.session.bulk_save_objects(new_alerts)
+    return results
+
+
 def monitor_faces():
-    """Kept for compatibility — browser-based mode uses /analyze_frame instead."""
+    """Recognition stage — consumes frames processed by the pipeline while monitoring is active."""
+    global pending_faces_detected
+
     print("ℹ️ Monitoring thread started (browser-camera mode — waiting for /analyze_frame calls)")
-    while monitoring_active:
-        time.sleep(5)
+    pipeline_run = frame_pipeline.start()
+    while monitoring_active.is_set():
+        try:
+            batch = [frame_pipeline.get(timeout=1)]
+        except queue.Empty:
+            continue
+        # Frames that finished while the last batch was being recognized share one commit
+        batch.extend(frame_pipeline.drain())
+
+        with app.app_context():
+            try:
+                results = []
+                for detected_faces in batch:
+                    results.extend(_recognize_faces(detected_faces))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Face recognition error: {e}")
+                continue
+
+        with results_lock:
+            pending_results.extend(results)
+            pending_faces_detected += sum(len(detected_faces) for detected_faces in batch)
+
+    frame_pipeline.stop(pipeline_run)
     print("ℹ️ Monitoring thread stopped.")
 
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        upgrade_legacy_students()
     app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5000)
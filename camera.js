@@ -1,13 +1,15 @@
 /* =============================================
    CLASSROOM FACE MONITOR — Browser Camera via getUserMedia
    The browser accesses the webcam directly (no OpenCV needed).
-   Frames are sent to /analyze_frame for AI face recognition.
+   Frames are pushed over the /ws/frames WebSocket (or POSTed to /analyze_frame) as raw JPEG
+   for AI face recognition.
    ============================================= */
 
 const CameraFeed = (() => {
     let stream = null;
     let analyzeInterval = null;
     let isActive = false;
+    let frameSocket = null;   // WebSocket to /ws/frames (HTTP POST is the fallback)
     const ANALYZE_EVERY_MS = 3000; // send a frame for AI analysis every 3s
 
     // DOM refs
@@ -71,6 +73,7 @@ const CameraFeed = (() => {
             showToast('📷 Camera active — monitoring started', 'success');
 
             // 4. Start sending frames to AI every few seconds
+            openFrameSocket();
             analyzeInterval = setInterval(sendFrameForAnalysis, ANALYZE_EVERY_MS);
 
         } catch (err) {
@@ -92,6 +95,7 @@ const CameraFeed = (() => {
 
         // Stop sending frames
         if (analyzeInterval) { clearInterval(analyzeInterval); analyzeInterval = null; }
+        closeFrameSocket();
 
         // Stop webcam stream
         if (stream) { stream.getTracks().forEach(t => t.stop()); stream = null; }
@@ -111,6 +115,33 @@ const CameraFeed = (() => {
         setActiveState(false);
     }
 
+    function openFrameSocket() {
+        if (!('WebSocket' in window)) return;
+        const proto = location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const ws = new WebSocket(`${proto}//${location.host}/ws/frames`);
+        ws.onmessage = e => {
+            try { handleAnalysis(JSON.parse(e.data)); } catch (err) { console.warn('Frame analysis error:', err); }
+        };
+        ws.onclose = () => { if (frameSocket === ws) frameSocket = null; };
+        frameSocket = ws;
+    }
+
+    function closeFrameSocket() {
+        if (frameSocket) { frameSocket.close(); frameSocket = null; }
+    }
+
+    function handleAnalysis(data) {
+        if (data.status === 'success' && data.faces_detected > 0) {
+            data.results.forEach(r => {
+                if (r.recognized) {
+                    showToast(`✅ Recognised: ${r.name} (${(r.confidence * 100).toFixed(0)}%)`, 'success');
+                } else {
+                    showToast('🚨 Unknown person detected!', 'error');
+                }
+            });
+        }
+    }
+
     async function sendFrameForAnalysis() {
         if (!isActive || !stream || !videoEl || videoEl.readyState < 2) return;
 
@@ -118,21 +149,34 @@ const CameraFeed = (() => {
             const ctx = canvas.getContext('2d');
             ctx.drawImage(videoEl, 0, 0, canvas.width, canvas.height);
 
-            // Get JPEG base64 (strip the data:image/jpeg;base64, prefix)
-            const dataUrl = canvas.toDataURL('image/jpeg', 0.7);
-            const b64frame = dataUrl.split(',')[1];
+            let data;
+            const blob = canvas.toBlob
+                ? await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.7))
+                : null;
 
-            const data = await postJson('/analyze_frame', { frame: b64frame });
+            if (blob && frameSocket && frameSocket.readyState === WebSocket.OPEN) {
+                // Skip this frame while the previous one is still being sent (back-pressure);
+                // the reply arrives in frameSocket.onmessage
+                if (frameSocket.bufferedAmount === 0) frameSocket.send(blob);
+                return;
+            }
 
-            if (data.status === 'success' && data.faces_detected > 0) {
-                data.results.forEach(r => {
-                    if (r.recognized) {
-                        showToast(`✅ Recognised: ${r.name} (${(r.confidence * 100).toFixed(0)}%)`, 'success');
-                    } else {
-                        showToast('🚨 Unknown person detected!', 'error');
-                    }
+            if (blob) {
+                // Send the JPEG bytes as-is — no base64 or JSON wrapping
+                const res = await fetch('/analyze_frame', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'image/jpeg' },
+                    body: blob
                 });
+                data = await res.json();
+            } else {
+                // Fallback: JPEG base64 (strip the data:image/jpeg;base64, prefix)
+                const dataUrl = canvas.toDataURL('image/jpeg', 0.7);
+                const b64frame = dataUrl.split(',')[1];
+                data = await postJson('/analyze_frame', { frame: b64frame });
             }
+
+            handleAnalysis(data);
         } catch (e) {
             console.warn('Frame analysis error:', e);
         }
@@ -1,5 +1,8 @@
 import os
+import sqlite3
 from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 load_dotenv()
 
@@ -13,11 +16,61 @@ class Config:
     # OpenRouter AI Configuration
     OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY')
     OPENROUTER_BASE_URL = os.environ.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
+    AI_MAX_CONCURRENT_REQUESTS = int(os.environ.get('AI_MAX_CONCURRENT_REQUESTS', 8))
+    AI_CACHE_SIZE = int(os.environ.get('AI_CACHE_SIZE', 10000))
+    AI_CACHE_TTL = int(os.environ.get('AI_CACHE_TTL', 3600))  # seconds
+    AI_CACHE_MODE = os.environ.get('AI_CACHE_MODE', 'enabled')  # enabled | replay | disabled
+    AI_CACHE_DIR = os.environ.get('AI_CACHE_DIR', '')  # set to also keep responses on disk (e.g. cache/ai)
+    AI_JPEG_QUALITY = int(os.environ.get('AI_JPEG_QUALITY', 70))  # images sent to OpenRouter
+    AI_REQUESTS_PER_MINUTE = int(os.environ.get('AI_REQUESTS_PER_MINUTE', 20))
+    AI_TOKENS_PER_MINUTE = int(os.environ.get('AI_TOKENS_PER_MINUTE', 100000))
+    
+    # Local face detection (OpenCV YuNet) — OpenRouter is used if the model file is missing
+    FACE_DETECTION_MODEL = os.environ.get('FACE_DETECTION_MODEL', 'weights/face_detection_yunet_2023mar.onnx')
+    FACE_DETECTION_THRESHOLD = float(os.environ.get('FACE_DETECTION_THRESHOLD', 0.8))
+    
+    # Local face embedding (ArcFace, 512-D) — OpenRouter feature descriptions are used if missing
+    FACE_EMBEDDING_MODEL = os.environ.get('FACE_EMBEDDING_MODEL', 'weights/arcface.onnx')
+    # Input normalization for that model, (pixel - mean) / std per RGB channel. The defaults pass raw
+    # 0-255 pixels, which is what arcfaceresnet100-8.onnx expects (it subtracts 127.5 and scales inside
+    # its graph); use 127.5 / 127.5 for exports that leave normalization to the caller (e.g. insightface w600k_r50)
+    FACE_EMBEDDING_MEAN = float(os.environ.get('FACE_EMBEDDING_MEAN', 0.0))
+    FACE_EMBEDDING_STD = float(os.environ.get('FACE_EMBEDDING_STD', 1.0))
+    EMBEDDING_MATCH_THRESHOLD = float(os.environ.get('EMBEDDING_MATCH_THRESHOLD', 0.5))
+    
+    # OpenRouter detection only: a frame whose 64x48 grayscale thumbnail differs from the last processed
+    # frame's by less than this on every pixel reuses its result (0 disables); a full pass is still
+    # forced once the reused result is FRAME_REUSE_MAX_AGE seconds old
+    FRAME_DIFF_THRESHOLD = int(os.environ.get('FRAME_DIFF_THRESHOLD', 12))
+    FRAME_REUSE_MAX_AGE = float(os.environ.get('FRAME_REUSE_MAX_AGE', 5))
+    
+    # A detected face overlapping a tracked face by more than this IOU reuses its features;
+    # features are re-extracted TRACK_REEXTRACT_AFTER processed frames after extraction regardless
+    # of overlap, and tracks not seen for TRACK_MAX_AGE processed frames are dropped.
+    # The dashboard sends one frame every ANALYZE_EVERY_MS (3 s, camera.js), so the defaults
+    # refresh a seated student's identity about every 15 s and forget a face missing for ~9 s
+    TRACK_IOU_THRESHOLD = float(os.environ.get('TRACK_IOU_THRESHOLD', 0.5))
+    TRACK_REEXTRACT_AFTER = int(os.environ.get('TRACK_REEXTRACT_AFTER', 5))
+    TRACK_MAX_AGE = int(os.environ.get('TRACK_MAX_AGE', 3))
+    
+    # Frames posted to /analyze_frame wider than this are downscaled before detection (0 disables)
+    ANALYZE_MAX_WIDTH = int(os.environ.get('ANALYZE_MAX_WIDTH', 640))
+    
+    # Templates are only re-checked for edits on render when enabled (even under debug=True);
+    # set JINJA_BYTECODE_CACHE_DIR to reuse compiled templates across processes and restarts
+    TEMPLATES_AUTO_RELOAD = os.environ.get('TEMPLATES_AUTO_RELOAD', 'false').lower() == 'true'
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR', '')
     
     # Upload Configuration
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'static/uploads/known_faces')
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16777216))  # 16MB
     
+    # Static files (student photos): hand the file to the front-end server instead of streaming it
+    # through Python. X-Sendfile works with Apache/lighttpd; for nginx also set X_ACCEL_REDIRECT_PREFIX
+    # to an internal location aliased to the static folder (e.g. /protected-static/)
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
+    X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '')
+    
     # Alarm Configuration
     ALARM_SOUND_PATH = os.environ.get('ALARM_SOUND_PATH', 'static/sounds/alarm.mp3')
     ALERT_EMAIL = os.environ.get('ALERT_EMAIL', 'admin@school.com')
@@ -30,4 +83,19 @@ class Config:
         
         # Create sounds directory
         sounds_path = os.path.join(app.instance_path, '..', 'static/sounds')
-        os.makedirs(sounds_path, exist_ok=True)
\ No newline at end of file
+        os.makedirs(sounds_path, exist_ok=True)
+        
+        # SQLite: write-ahead log + relaxed fsync, so per-frame commits don't each wait on the disk
+        if not event.contains(Engine, 'connect', _set_sqlite_pragmas):
+            event.listen(Engine, 'connect', _set_sqlite_pragmas)
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every new SQLite connection (other databases are left alone)"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256MB
+    cursor.close()
\ No newline at end of file
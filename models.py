@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import LargeBinary, inspect, text
 from datetime import datetime
 import json
+import numpy as np
 
 db = SQLAlchemy()
 
@@ -13,7 +15,8 @@ class Student(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=True)
     phone = db.Column(db.String(20), nullable=True)
     photo_path = db.Column(db.String(255), nullable=False)
-    face_encoding = db.Column(db.Text, nullable=True)  # Store face encoding as JSON string
+    face_encoding = db.Column(db.LargeBinary, nullable=True)  # Face embedding as raw float32 bytes
+    face_features = db.Column(db.Text, nullable=True)  # OpenRouter feature description as JSON string
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -22,15 +25,25 @@ class Student(db.Model):
     entry_logs = db.relationship('EntryLog', backref='student', lazy=True, cascade='all, delete-orphan')
     
     def set_face_encoding(self, encoding):
-        """Convert numpy array to JSON string for storage"""
+        """Convert numpy array to float32 bytes for storage"""
         if encoding is not None:
-            self.face_encoding = json.dumps(encoding.tolist())
+            self.face_encoding = np.ascontiguousarray(encoding, dtype=np.float32).tobytes()
     
     def get_face_encoding(self): 
-        """Convert JSON string back to numpy array"""
+        """View the stored bytes as a float32 numpy array (no copy)"""
         if self.face_encoding:
-            import numpy as np
-            return np.array(json.loads(self.face_encoding))
+            return np.frombuffer(self.face_encoding, dtype=np.float32)
+        return None
+    
+    def set_face_features(self, features):
+        """Convert an OpenRouter feature description to JSON string for storage"""
+        if features:
+            self.face_features = json.dumps(features)
+    
+    def get_face_features(self):
+        """Convert JSON string back to a feature description"""
+        if self.face_features:
+            return json.loads(self.face_features)
         return None
     
     def to_dict(self):
@@ -51,8 +64,8 @@ class EntryLog(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=True)
-    entry_time = db.Column(db.DateTime, default=datetime.utcnow)
-    is_recognized = db.Column(db.Boolean, default=False)
+    entry_time = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    is_recognized = db.Column(db.Boolean, default=False, index=True)
     confidence_score = db.Column(db.Float, nullable=True)
     image_path = db.Column(db.String(255), nullable=True)  # Store captured image
     notes = db.Column(db.Text, nullable=True)
@@ -76,8 +89,8 @@ class SystemAlert(db.Model):
     alert_type = db.Column(db.String(50), nullable=False)  # 'unknown_person', 'system_error', etc.
     message = db.Column(db.Text, nullable=False)
     severity = db.Column(db.String(20), default='medium')  # 'low', 'medium', 'high', 'critical'
-    is_resolved = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    is_resolved = db.Column(db.Boolean, default=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     resolved_at = db.Column(db.DateTime, nullable=True)
     image_path = db.Column(db.String(255), nullable=True)
     
@@ -91,4 +104,46 @@ class SystemAlert(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'resolved_at': self.resolved_at.isoformat() if self.resolved_at else None,
             'image_path': self.image_path
-        }
\ No newline at end of file
+        }
+
+# Serves "unresolved alerts, newest first" without a sort
+db.Index('ix_alert_unresolved_created', SystemAlert.is_resolved, SystemAlert.created_at.desc())
+
+def upgrade_legacy_students():
+    """
+    One-off conversion of a students table written by older versions, which kept both ArcFace
+    embeddings and OpenRouter descriptions as JSON text in face_encoding. Embeddings become float32
+    bytes, descriptions move to face_features. Safe to run on every start; converted rows are skipped.
+    """
+    columns = {column['name']: column for column in inspect(db.engine).get_columns('students')}
+    with db.engine.begin() as conn:
+        if 'face_features' not in columns:
+            conn.execute(text('ALTER TABLE students ADD COLUMN face_features TEXT'))
+
+        # Raw SQL, so legacy values come back as str instead of going through LargeBinary
+        legacy = [(row_id, raw) for row_id, raw in conn.execute(
+            text('SELECT id, face_encoding FROM students WHERE face_encoding IS NOT NULL')
+        ) if isinstance(raw, str)]
+        if not legacy:
+            return
+
+        if conn.dialect.name != 'sqlite' and not isinstance(columns['face_encoding']['type'], LargeBinary):
+            # SQLite keeps bytes in a TEXT column; PostgreSQL needs the column retyped (values are re-written below)
+            conn.execute(text('ALTER TABLE students ALTER COLUMN face_encoding TYPE BYTEA USING NULL'))
+
+        for row_id, raw in legacy:
+            encoding, features = None, raw
+            try:
+                value = json.loads(raw)
+            except ValueError:
+                print(f"Dropping unreadable face encoding of student {row_id} — re-enroll this student")
+                features = None
+            else:
+                if isinstance(value, list) and value and all(isinstance(v, (int, float)) for v in value):
+                    encoding, features = np.asarray(value, dtype=np.float32).tobytes(), None
+            conn.execute(
+                text('UPDATE students SET face_encoding = :encoding, '
+                     'face_features = COALESCE(face_features, :features) WHERE id = :id'),
+                {'encoding': encoding, 'features': features, 'id': row_id}
+            )
+        print(f"Converted {len(legacy)} legacy face encoding(s) to the float32 format")
\ No newline at end of file